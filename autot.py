@@ -1,4 +1,9 @@
+import io
 import os
+
+# Must be set before numpy/torch initialize their thread pools
+os.environ.setdefault('OMP_NUM_THREADS', str(os.cpu_count()))
+
 import re
 import glob
 import ollama
@@ -7,63 +12,176 @@ import json
 import argparse
 import sys
 import hashlib
+import shelve
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity  # kept to preserve functionality, even if unused
 
-# --- New: LangChain prompt imports (robust to different installs) ---
+# --- New: PDF and HTML processing imports ---
+# Prefer PyMuPDF (MuPDF C bindings, much faster extraction); fall back to PyPDF2.
 try:
-    from langchain_core.prompts import PromptTemplate
-except Exception:
-    from langchain.prompts import PromptTemplate
+    import fitz  # PyMuPDF
+    MUPDF_SUPPORT = True
+except ImportError:
+    MUPDF_SUPPORT = False
 
-# --- New: PDF and HTML processing imports ---
 try:
     import PyPDF2
     PDF_SUPPORT = True
 except ImportError:
     PDF_SUPPORT = False
-    print("Warning: PyPDF2 not installed. PDF files will be skipped.")
+    if not MUPDF_SUPPORT:
+        print("Warning: Neither PyMuPDF nor PyPDF2 installed. PDF files will be skipped.")
 
 try:
     from bs4 import BeautifulSoup
     HTML_SUPPORT = True
+    # Prefer the lxml C parser; html.parser is pure Python and much slower.
+    try:
+        import lxml  # noqa: F401
+        HTML_PARSER = 'lxml'
+    except ImportError:
+        HTML_PARSER = 'html.parser'
 except ImportError:
     HTML_SUPPORT = False
     print("Warning: BeautifulSoup not installed. HTML files will be skipped.")
 
+try:
+    from sentence_transformers.quantization import quantize_embeddings
+    QUANT_SUPPORT = True
+except ImportError:
+    QUANT_SUPPORT = False
+
+# --- New: fast content hashing for cache keys ---
+# Cache keys don't need cryptographic strength; prefer SIMD-parallel BLAKE3,
+# then xxHash, then fall back to MD5.
+try:
+    import blake3
+
+    def _content_hash(data):
+        return blake3.blake3(data).hexdigest()
+except ImportError:
+    try:
+        import xxhash
+
+        def _content_hash(data):
+            return xxhash.xxh3_128_hexdigest(data)
+    except ImportError:
+        def _content_hash(data):
+            return hashlib.md5(data).hexdigest()
+
+try:
+    import diskcache
+    DISKCACHE_SUPPORT = True
+except ImportError:
+    DISKCACHE_SUPPORT = False
+
+try:
+    from cachetools import LRUCache
+    CACHETOOLS_SUPPORT = True
+except ImportError:
+    CACHETOOLS_SUPPORT = False
+
+# Precompiled patterns for the hot doc-processing and output-parsing paths
+_SECTION_RE = re.compile(r'\n\s*\n')
+_EXAMPLE_PREFIX_RE = re.compile(r';+\s*Example:?\s*')
+_COMMENT_RE = re.compile(r';.*')
+_WS_RE = re.compile(r'\s+')
+_LISP_BLOCK_RE = re.compile(r'```lisp\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+_COMMENTS_BLOCK_RE = re.compile(r'```comments\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+_THINK_TAG_RE = re.compile(r'<think>(.*?)</think>', re.DOTALL | re.IGNORECASE)
+_THINK_BLOCK_RE = re.compile(r'```think\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+
 
 class LispTranslationRAG:
     def __init__(self, src_docs_path, trg_docs_path, ollama_model='deepseek-r1:70b'):
-        self.model = SentenceTransformer('all-mpnet-base-v2')
+        # Pin CPU thread counts before loading the model: PyTorch's defaults
+        # can undersubscribe intra-op parallelism on many-core machines.
+        try:
+            import torch
+            torch.set_num_threads(os.cpu_count())
+            torch.set_num_interop_threads(1)
+        except Exception:
+            pass  # torch missing (e.g. ONNX-only install) or threads already set
+
+        # Prefer the ONNX backend when available (onnxruntime + optimum):
+        # same 768-dim output, noticeably faster CPU encoding than the
+        # default PyTorch graph.
+        try:
+            self.model = SentenceTransformer('all-mpnet-base-v2', backend='onnx')
+        except Exception:
+            self.model = SentenceTransformer('all-mpnet-base-v2')
         self.ollama = ollama_model
         self.src_docs_path = src_docs_path
         self.trg_docs_path = trg_docs_path
 
         # Initialize databases with context-aware storage
         self.src_db = {
-            'embeddings': np.zeros((0, 768)),
+            'embeddings': np.zeros((0, 768), dtype=np.float32),
             'samples': [],  # (code, context) tuples
-            'text_embeddings': np.zeros((0, 768)),
-            'text_chunks': []
+            'text_embeddings': np.zeros((0, 768), dtype=np.float32),
+            'text_chunks': [],
+            'emb_ranges': None,  # per-dim (min, max) when embeddings are int8-quantized
+            'text_emb_ranges': None
         }
         self.trg_db = {
-            'embeddings': np.zeros((0, 768)),
+            'embeddings': np.zeros((0, 768), dtype=np.float32),
             'samples': [],  # (code, context) tuples
-            'text_embeddings': np.zeros((0, 768)),
-            'text_chunks': []
+            'text_embeddings': np.zeros((0, 768), dtype=np.float32),
+            'text_chunks': [],
+            'emb_ranges': None,
+            'text_emb_ranges': None
         }
         self.done_db = {
-            'embeddings': np.zeros((0, 768)),
+            'embeddings': np.zeros((0, 768), dtype=np.float32),
             'samples': [],  # (code, context) tuples (here: normalized source snippets)
-            'text_embeddings': np.zeros((0, 768)),
+            'text_embeddings': np.zeros((0, 768), dtype=np.float32),
             'text_chunks': [],
             'filepaths': []
         }
-        self.translation_cache = {}
+        # Bounded in long translate_directory runs: entries hold full
+        # translation outputs, so an unbounded dict grows with every file.
+        self.translation_cache = LRUCache(maxsize=256) if CACHETOOLS_SUPPORT else {}
+
+        # Preallocated append buffer for done_db embeddings (grown by doubling,
+        # like list.append); done_db['embeddings'] is the logical [:count] view.
+        self._done_emb_buf = np.zeros((0, 768), dtype=np.float32)
+        self._done_count = 0
+
+        # On-disk embedding cache keyed by content hash: repeated contexts
+        # and DB rebuilds reuse prior model.encode results across runs.
+        try:
+            self._emb_cache = shelve.open('emb_cache.db')
+        except Exception as e:
+            print(f"Warning: Could not open embedding cache - {str(e)}")
+            self._emb_cache = {}
+
+        # Persistent exact-prompt cache: an identical (model, prompt) pair on
+        # a later run skips the Ollama generation entirely.
+        self._prompt_cache = diskcache.Cache('.autot_cache') if DISKCACHE_SUPPORT else None
+
+        # Serializes done_db/progress-file writes when translations run on
+        # a thread pool.
+        self._write_lock = threading.Lock()
+
+        # Guards translation_cache (LRUCache is not thread-safe) and the
+        # shelve-backed embedding cache (interleaved writes can corrupt the
+        # dbm file on disk).
+        self._cache_lock = threading.Lock()
+
+        # Rendered source/target example blocks; the underlying samples are
+        # fixed after prepare_context_dbs, so render once instead of per file.
+        self._src_block = "None"
+        self._trg_block = "None"
 
     # --- New: File type detection and content extraction ---
-    def _extract_text_from_file(self, filepath):
-        """Extract text content from various file types (TXT, HTML, PDF)"""
+    @staticmethod
+    def _extract_text_from_file(filepath):
+        """Extract text content from various file types (TXT, HTML, PDF)
+
+        Static so worker processes can pickle it without dragging the
+        SentenceTransformer model along.
+        """
         ext = os.path.splitext(filepath)[1].lower()
 
         try:
@@ -73,12 +191,16 @@ class LispTranslationRAG:
 
             elif ext == '.html' and HTML_SUPPORT:
                 with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    soup = BeautifulSoup(f.read(), 'html.parser')
+                    soup = BeautifulSoup(f.read(), HTML_PARSER)
                     # Remove script and style elements
                     for script in soup(["script", "style"]):
                         script.decompose()
                     return soup.get_text()
 
+            elif ext == '.pdf' and MUPDF_SUPPORT:
+                with fitz.open(filepath) as doc:
+                    return "\n".join(page.get_text() for page in doc)
+
             elif ext == '.pdf' and PDF_SUPPORT:
                 with open(filepath, 'rb') as f:
                     reader = PyPDF2.PdfReader(f)
@@ -101,16 +223,27 @@ class LispTranslationRAG:
             print(f"Error: Directory {dir_path} does not exist")
             return ""
 
+        # Collect all supported files in a single directory walk (one recursive
+        # glob per extension would traverse the tree three times)
+        paths = []
+        for root, _, files in os.walk(dir_path):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in {'.txt', '.html', '.pdf'}:
+                    paths.append(os.path.join(root, name))
+        paths.sort()
+
         all_content = []
 
-        # Process all supported file types
-        for pattern in ['*.txt', '*.html', '*.pdf']:
-            for filepath in glob.glob(os.path.join(dir_path, '**', pattern), recursive=True):
-                print(f"Processing: {filepath}")
-                content = self._extract_text_from_file(filepath)
-                if content.strip():
-                    all_content.append(f"\n--- Content from {os.path.basename(filepath)} ---\n")
-                    all_content.append(content)
+        # PDF/HTML parsing is CPU-bound; a process pool sidesteps the GIL
+        # and parallelizes across files. Logging happens in the parent to
+        # keep output ordered.
+        if paths:
+            with ProcessPoolExecutor() as executor:
+                for filepath, content in zip(paths, executor.map(self._extract_text_from_file, paths)):
+                    print(f"Processed: {filepath}")
+                    if content.strip():
+                        all_content.append(f"\n--- Content from {os.path.basename(filepath)} ---\n")
+                        all_content.append(content)
 
         # Also check if the path itself is a file
         if os.path.isfile(dir_path):
@@ -120,38 +253,105 @@ class LispTranslationRAG:
 
         return "\n".join(all_content)
 
+    # --- Embedding quantization -------------------------------------------
+
+    @staticmethod
+    def _quantize(embeddings):
+        """Scalar-quantize float32 embeddings to int8 (768 B/vec instead of 3072 B/vec).
+
+        Returns (quantized, ranges) where ranges holds the per-dimension
+        (min, max) needed to quantize queries consistently at retrieval time.
+        Returns the input unchanged with ranges=None if quantization is
+        unavailable or the matrix is empty.
+        """
+        if not QUANT_SUPPORT or embeddings.shape[0] == 0:
+            return embeddings, None
+        ranges = np.vstack([embeddings.min(axis=0), embeddings.max(axis=0)]).astype(np.float32)
+        quantized = quantize_embeddings(embeddings, precision='int8', ranges=ranges)
+        return quantized, ranges
+
+    # --- Memoized encoding -------------------------------------------------
+
+    def _encode(self, text):
+        """Encode a single string, memoized in the on-disk embedding cache."""
+        key = hashlib.sha1(text.encode()).hexdigest()
+        with self._cache_lock:
+            cached = self._emb_cache.get(key)
+        if cached is not None:
+            return cached
+        embedding = self.model.encode(
+            text, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+        with self._cache_lock:
+            self._emb_cache[key] = embedding
+        return embedding
+
+    def _encode_batch(self, texts):
+        """Encode a list of strings, batching only the cache misses."""
+        keys = [hashlib.sha1(t.encode()).hexdigest() for t in texts]
+        with self._cache_lock:
+            embeddings = [self._emb_cache.get(k) for k in keys]
+        miss_idx = [i for i, e in enumerate(embeddings) if e is None]
+        if miss_idx:
+            encoded = self.model.encode(
+                [texts[i] for i in miss_idx], batch_size=64, convert_to_numpy=True,
+                normalize_embeddings=True, show_progress_bar=True
+            ).astype(np.float32, copy=False)
+            with self._cache_lock:
+                for row, i in zip(encoded, miss_idx):
+                    embeddings[i] = row
+                    self._emb_cache[keys[i]] = row
+        return np.asarray(embeddings, dtype=np.float32)
+
     # --- Persistence for context DBs --------------------------------------
 
     def _save_db(self, db, path):
-        """Save a context DB (src/trg) to JSON."""
+        """Save a context DB (src/trg): samples/chunks as JSON, embeddings as sibling .npy files."""
         try:
             data = {
-                'embeddings': db['embeddings'].tolist() if isinstance(db['embeddings'], np.ndarray) else db['embeddings'],
                 'samples': db['samples'],
-                'text_embeddings': db['text_embeddings'].tolist() if isinstance(db['text_embeddings'], np.ndarray) else db['text_embeddings'],
                 'text_chunks': db['text_chunks'],
             }
             with open(path, 'w', encoding='utf-8') as f:
                 json.dump(data, f)
+            # Binary is far smaller than JSON text and loads without re-parsing
+            # floats; .npy also allows memory-mapped reads. Embeddings keep
+            # their native dtype (int8 when quantized, float32 otherwise).
+            np.save(path + '.emb.npy', np.asarray(db['embeddings']))
+            np.save(path + '.txt_emb.npy', np.asarray(db['text_embeddings']))
+            if db.get('emb_ranges') is not None:
+                np.save(path + '.emb.ranges.npy', db['emb_ranges'])
+            if db.get('text_emb_ranges') is not None:
+                np.save(path + '.txt_emb.ranges.npy', db['text_emb_ranges'])
         except Exception as e:
             print(f"Warning: Could not save DB to {path} - {str(e)}")
 
     def _load_db(self, path):
-        """Load a context DB (src/trg) from JSON. Returns a dict or None on failure."""
+        """Load a context DB (src/trg) from JSON + .npy files. Returns a dict or None on failure."""
         try:
             with open(path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             db = {
-                'embeddings': np.array(data.get('embeddings', [])),
                 'samples': data.get('samples', []),
-                'text_embeddings': np.array(data.get('text_embeddings', [])),
                 'text_chunks': data.get('text_chunks', []),
             }
+            if os.path.exists(path + '.emb.npy'):
+                db['embeddings'] = np.load(path + '.emb.npy', mmap_mode='r')
+                db['text_embeddings'] = np.load(path + '.txt_emb.npy', mmap_mode='r')
+                for key, suffix in (('emb_ranges', '.emb.ranges.npy'),
+                                    ('text_emb_ranges', '.txt_emb.ranges.npy')):
+                    db[key] = np.load(path + suffix) if os.path.exists(path + suffix) else None
+            else:
+                # Legacy format: embeddings inline in the JSON
+                db['embeddings'] = np.array(data.get('embeddings', []), dtype=np.float32)
+                db['text_embeddings'] = np.array(data.get('text_embeddings', []), dtype=np.float32)
+                db['emb_ranges'] = None
+                db['text_emb_ranges'] = None
             # Shape fixes if empty
             if db['embeddings'].size == 0:
-                db['embeddings'] = np.zeros((0, 768))
+                db['embeddings'] = np.zeros((0, 768), dtype=np.float32)
             if db['text_embeddings'].size == 0:
-                db['text_embeddings'] = np.zeros((0, 768))
+                db['text_embeddings'] = np.zeros((0, 768), dtype=np.float32)
             return db
         except Exception as e:
             print(f"Warning: Could not load DB from {path} - {str(e)}")
@@ -193,24 +393,80 @@ class LispTranslationRAG:
             self._save_db(self.trg_db, trg_db_path)
             print(f"Saved target context DB to: {trg_db_path}")
 
+        # Example blocks are static once the DBs are in place
+        self._src_block = self._render_example_block(self.src_db['samples'][:3])
+        self._trg_block = self._render_example_block(self.trg_db['samples'][:3])
+
         print("\nContext DB Status:")
         print(f"Source: {len(self.src_db['samples'])} code-context pairs, {len(self.src_db['text_chunks'])} text chunks")
         print(f"Target: {len(self.trg_db['samples'])} code-context pairs, {len(self.trg_db['text_chunks'])} text chunks")
 
     # --- Doc processing ----------------------------------------------------
 
+    @staticmethod
+    def _scan_sexprs(text):
+        """Yield (start, end) spans of top-level parenthesized expressions.
+
+        A single linear pass with a depth counter; unlike the old non-greedy
+        regex it matches nested Lisp forms to their closing paren instead of
+        stopping at the first ')'.
+        """
+        depth = 0
+        start = -1
+        for i, c in enumerate(text):
+            if c == '(':
+                if depth == 0:
+                    start = i
+                depth += 1
+            elif c == ')' and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    yield (start, i + 1)
+
+    @classmethod
+    def _strip_sexprs(cls, text):
+        """Return the text with all top-level parenthesized expressions removed."""
+        parts = []
+        prev_end = 0
+        for start, end in cls._scan_sexprs(text):
+            parts.append(text[prev_end:start])
+            prev_end = end
+        parts.append(text[prev_end:])
+        return ''.join(parts)
+
     def _extract_code_context_pairs(self, text):
         """Extract (code, context) pairs from documentation"""
-        sections = re.split(r'\n\s*\n', text)
+        sections = _SECTION_RE.split(text)
         pairs = []
         for section in sections:
-            code_blocks = re.findall(r'(?:^|\n)(?:;+\s*Example:?\s*)?(\(.*?\))(?=\n|$)', section, re.DOTALL)
-            if code_blocks:
-                context = re.sub(r'(\(.*?\))', '', section)
-                context = ' '.join(context.split()).strip()
-                for code in code_blocks:
-                    if code.strip():
-                        pairs.append((code.strip(), context))
+            # Keep only line-anchored forms, as the old regex did: the form
+            # must start a line (optionally after a "; Example:" comment) and
+            # its closing paren must end one. Mid-prose parentheticals like
+            # "(see below)" stay part of the context.
+            spans = []
+            for start, end in self._scan_sexprs(section):
+                prefix = section[section.rfind('\n', 0, start) + 1:start]
+                if prefix and _EXAMPLE_PREFIX_RE.fullmatch(prefix) is None:
+                    continue
+                if end < len(section) and section[end] != '\n':
+                    continue
+                spans.append((start, end))
+            if not spans:
+                continue
+            # One scan yields both the code spans and their complement,
+            # which becomes the shared context for the section
+            codes = []
+            context_parts = []
+            prev_end = 0
+            for start, end in spans:
+                context_parts.append(section[prev_end:start])
+                codes.append(section[start:end].strip())
+                prev_end = end
+            context_parts.append(section[prev_end:])
+            context = ' '.join(''.join(context_parts).split()).strip()
+            for code in codes:
+                if code:
+                    pairs.append((code, context))
         return pairs
 
     def _process_doc_content(self, content, source_name="document"):
@@ -218,7 +474,7 @@ class LispTranslationRAG:
         code_context_pairs = self._extract_code_context_pairs(content)
         text_chunks = [
             chunk.strip() for chunk in
-            re.split(r'\n\s*\n', re.sub(r'\(.*?\)', '', content))
+            _SECTION_RE.split(self._strip_sexprs(content))
             if chunk.strip() and len(chunk.split()) > 5
         ]
         return code_context_pairs, text_chunks
@@ -226,10 +482,12 @@ class LispTranslationRAG:
     def _build_enhanced_database(self, doc_path, db):
         """Build database with both code-context pairs and text chunks from files or directories"""
         # Clear the database first
-        db['embeddings'] = np.zeros((0, 768))
+        db['embeddings'] = np.zeros((0, 768), dtype=np.float32)
         db['samples'] = []
-        db['text_embeddings'] = np.zeros((0, 768))
+        db['text_embeddings'] = np.zeros((0, 768), dtype=np.float32)
         db['text_chunks'] = []
+        db['emb_ranges'] = None
+        db['text_emb_ranges'] = None
 
         # Extract content from the path (file or directory)
         if os.path.isdir(doc_path):
@@ -243,63 +501,111 @@ class LispTranslationRAG:
 
         code_context_pairs, text_chunks = self._process_doc_content(content, doc_path)
 
-        # Process code-context pairs
-        for code, context in code_context_pairs:
-            try:
-                code_embedding = self.model.encode(code).reshape(1, -1)
-                context_embedding = self.model.encode(context).reshape(1, -1)
+        # Batch-encode everything: one encode call per group instead of one per
+        # string, so tokenizer/model overhead is amortized across all items.
+        codes = [code for code, _ in code_context_pairs]
+        contexts = [context for _, context in code_context_pairs]
 
-                if db['embeddings'].shape[0] == 0:
-                    db['embeddings'] = code_embedding
-                else:
-                    db['embeddings'] = np.vstack([db['embeddings'], code_embedding])
-                db['samples'].append((code, context))
-
-                if db['text_embeddings'].shape[0] == 0:
-                    db['text_embeddings'] = context_embedding
-                else:
-                    db['text_embeddings'] = np.vstack([db['text_embeddings'], context_embedding])
-                db['text_chunks'].append(context)
-            except Exception as e:
-                print(f"Error processing sample: {str(e)}")
-
-        # Process additional text chunks
-        for chunk in text_chunks:
-            try:
-                chunk_embedding = self.model.encode(chunk).reshape(1, -1)
-                if db['text_embeddings'].shape[0] == 0:
-                    db['text_embeddings'] = chunk_embedding
-                else:
-                    db['text_embeddings'] = np.vstack([db['text_embeddings'], chunk_embedding])
-                db['text_chunks'].append(chunk)
-            except Exception as e:
-                print(f"Error processing text chunk: {str(e)}")
+        try:
+            if codes:
+                code_emb = self._encode_batch(codes)
+                db['embeddings'], db['emb_ranges'] = self._quantize(code_emb)
+                db['samples'] = list(code_context_pairs)
+
+            text_inputs = contexts + text_chunks
+            if text_inputs:
+                text_emb = self._encode_batch(text_inputs)
+                db['text_embeddings'], db['text_emb_ranges'] = self._quantize(text_emb)
+                db['text_chunks'] = text_inputs
+        except Exception as e:
+            print(f"Error encoding documentation content: {str(e)}")
 
     # --- Done DB persistence ----------------------------------------------
+    # Append-only format: done_db_meta.jsonl holds one {'path', 'snippet'}
+    # line per translation, done_db_emb.npy is a preallocated memory-mapped
+    # slab of embedding rows. Each update is an O(1) append instead of a full
+    # rewrite of the database.
+
+    DONE_META_PATH = 'done_db_meta.jsonl'
+    DONE_EMB_PATH = 'done_db_emb.npy'
 
     def _load_done_db(self):
-        """Load the done database from file if it exists"""
-        if os.path.exists('done_db.json'):
-            try:
+        """Load the done database, preferring the append-only log format"""
+        try:
+            if os.path.exists(self.DONE_META_PATH):
+                samples, filepaths = [], []
+                with open(self.DONE_META_PATH, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            filepaths.append(entry['path'])
+                            samples.append(entry['snippet'])
+                self._done_count = len(samples)
+                if os.path.exists(self.DONE_EMB_PATH):
+                    self._done_emb_buf = np.lib.format.open_memmap(self.DONE_EMB_PATH, mode='r+')
+                if self._done_emb_buf.shape[0] < self._done_count:
+                    print("Warning: done_db embedding slab shorter than metadata; truncating")
+                    self._done_count = self._done_emb_buf.shape[0]
+                    samples = samples[:self._done_count]
+                    filepaths = filepaths[:self._done_count]
+                self.done_db['samples'] = samples
+                self.done_db['filepaths'] = filepaths
+                self.done_db['embeddings'] = self._done_emb_buf[:self._done_count]
+            elif os.path.exists('done_db.json'):
+                # Legacy monolithic format; load and migrate to the log format
                 with open('done_db.json', 'r') as f:
                     data = json.load(f)
-                    self.done_db['embeddings'] = np.array(data.get('embeddings', []))
-                    self.done_db['samples'] = data.get('samples', [])
-                    self.done_db['filepaths'] = data.get('filepaths', [])
-                    if self.done_db['embeddings'].size == 0:
-                        self.done_db['embeddings'] = np.zeros((0, 768))
-            except Exception as e:
-                print(f"Warning: Could not load done_db - {str(e)}")
+                if os.path.exists('done_db.json.emb.npy'):
+                    self._done_emb_buf = np.array(
+                        np.load('done_db.json.emb.npy', mmap_mode='r'), dtype=np.float32
+                    )
+                else:
+                    self._done_emb_buf = np.array(data.get('embeddings', []), dtype=np.float32)
+                if self._done_emb_buf.size == 0:
+                    self._done_emb_buf = np.zeros((0, 768), dtype=np.float32)
+                # Legacy rows were encoded without normalize_embeddings=True;
+                # unit-norm them so the dot-product cosine in the semantic
+                # short-circuit stays a valid similarity (no-op if already unit)
+                norms = np.linalg.norm(self._done_emb_buf, axis=1, keepdims=True)
+                np.divide(self._done_emb_buf, norms, out=self._done_emb_buf, where=norms > 0)
+                self._done_count = self._done_emb_buf.shape[0]
+                self.done_db['embeddings'] = self._done_emb_buf[:self._done_count]
+                self.done_db['samples'] = data.get('samples', [])
+                self.done_db['filepaths'] = data.get('filepaths', [])
+                self._save_done_db()
+        except Exception as e:
+            print(f"Warning: Could not load done_db - {str(e)}")
+
+    def _grow_done_emb_slab(self, new_capacity):
+        """Grow the on-disk embedding slab by writing a larger .npy and swapping it in."""
+        tmp_path = self.DONE_EMB_PATH + '.tmp'
+        new_buf = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float32, shape=(new_capacity, 768)
+        )
+        new_buf[:self._done_count] = self._done_emb_buf[:self._done_count]
+        new_buf.flush()
+        del new_buf  # close the mapping before the rename
+        del self._done_emb_buf
+        os.replace(tmp_path, self.DONE_EMB_PATH)
+        self._done_emb_buf = np.lib.format.open_memmap(self.DONE_EMB_PATH, mode='r+')
 
     def _save_done_db(self):
-        """Save the done database to file"""
+        """Rewrite the done database in the append-only format (compaction/migration)"""
         try:
-            with open('done_db.json', 'w') as f:
-                json.dump({
-                    'embeddings': self.done_db['embeddings'].tolist(),
-                    'samples': self.done_db['samples'],
-                    'filepaths': self.done_db['filepaths']
-                }, f)
+            with open(self.DONE_META_PATH, 'w', encoding='utf-8') as f:
+                for path, snippet in zip(self.done_db['filepaths'], self.done_db['samples']):
+                    f.write(json.dumps({'path': path, 'snippet': snippet}) + '\n')
+            # 'embeddings' may be a view into a live memmap of DONE_EMB_PATH;
+            # copy it out and write to a tmp file before swapping, since
+            # truncating the mapped file in place would fault on the next read
+            embeddings = np.array(self.done_db['embeddings'], dtype=np.float32, copy=True)
+            tmp_path = self.DONE_EMB_PATH + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+            del self._done_emb_buf  # close any existing mapping before the rename
+            os.replace(tmp_path, self.DONE_EMB_PATH)
+            self._done_emb_buf = np.lib.format.open_memmap(self.DONE_EMB_PATH, mode='r+')
+            self.done_db['embeddings'] = self._done_emb_buf[:self._done_count]
         except Exception as e:
             print(f"Warning: Could not save done_db - {str(e)}")
 
@@ -307,46 +613,61 @@ class LispTranslationRAG:
         """Update the done database with a new translation"""
         try:
             processed_code = self._preprocess_code(source_code)
-            embedding = self.model.encode(processed_code).reshape(1, -1)
-
-            if self.done_db['embeddings'].shape[0] == 0:
-                self.done_db['embeddings'] = embedding
-            else:
-                self.done_db['embeddings'] = np.vstack([
-                    self.done_db['embeddings'],
-                    embedding
-                ])
-
-            self.done_db['samples'].append(processed_code)
-            self.done_db['filepaths'].append(filepath)
-            self._save_done_db()
+            embedding = self._encode(processed_code)
+
+            # Serialized: concurrent translations must not interleave slab
+            # rows and meta lines
+            with self._write_lock:
+                # Amortized O(1) append: double the slab when full instead of
+                # re-copying all prior rows on every insertion.
+                if self._done_count == self._done_emb_buf.shape[0]:
+                    self._grow_done_emb_slab(max(16, self._done_emb_buf.shape[0] * 2))
+                self._done_emb_buf[self._done_count] = embedding
+                self._done_count += 1
+                if hasattr(self._done_emb_buf, 'flush'):
+                    self._done_emb_buf.flush()
+                self.done_db['embeddings'] = self._done_emb_buf[:self._done_count]
+
+                self.done_db['samples'].append(processed_code)
+                self.done_db['filepaths'].append(filepath)
+                with open(self.DONE_META_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'path': filepath, 'snippet': processed_code}) + '\n')
         except Exception as e:
             print(f"Warning: Could not update done_db - {str(e)}")
 
     # --- Utilities ---------------------------------------------------------
 
+    @staticmethod
+    def _cosine_scores(embeddings, query):
+        """Cosine similarity of a query vector against a matrix of embeddings.
+
+        All vectors are unit-norm (encoded with normalize_embeddings=True), so
+        cosine reduces to a single BLAS matrix-vector product.
+        """
+        return embeddings @ query.astype(np.float32, copy=False)
+
     def _preprocess_code(self, code):
         """Normalize code for consistent processing"""
-        code = re.sub(r';.*', '', code)  # Remove Lisp line comments
-        code = re.sub(r'\s+', ' ', code).strip()  # Normalize whitespace
+        code = _COMMENT_RE.sub('', code)  # Remove Lisp line comments
+        code = _WS_RE.sub(' ', code).strip()  # Normalize whitespace
         return code
 
     def _extract_code_block(self, text):
         """Extract code from markdown block labeled as lisp; fallback to whole text if not found."""
-        match = re.search(r'```lisp\n(.*?)\n```', text, re.DOTALL | re.IGNORECASE)
+        match = _LISP_BLOCK_RE.search(text)
         return match.group(1).strip() if match else text.strip()
 
     def _extract_comments_block(self, text):
         """Extract comments/explanations from a ```comments block."""
-        match = re.search(r'```comments\n(.*?)\n```', text, re.DOTALL | re.IGNORECASE)
+        match = _COMMENTS_BLOCK_RE.search(text)
         return match.group(1).strip() if match else "No explanations provided"
 
     def _extract_think_block(self, text):
         """Extract a 'think' block if present. Supports <think>...</think> or ```think blocks."""
-        m1 = re.search(r'<think>(.*?)</think>', text, re.DOTALL | re.IGNORECASE)
+        m1 = _THINK_TAG_RE.search(text)
         if m1:
             return m1.group(1).strip()
-        m2 = re.search(r'```think\n(.*?)\n```', text, re.DOTALL | re.IGNORECASE)
+        m2 = _THINK_BLOCK_RE.search(text)
         if m2:
             return m2.group(1).strip()
         return None
@@ -356,67 +677,41 @@ class LispTranslationRAG:
         with open(path, 'w', encoding='utf-8') as f:
             f.write(content)
 
-    # --- Prompt builder (LangChain) ---------------------------------------
+    # --- Prompt builder ----------------------------------------------------
 
-    def _generate_contextual_prompt_with_langchain(self, source_code):
+    @staticmethod
+    def _render_example_block(samples):
+        """Render (code, context) samples into an example block for the prompt."""
+        examples = [f"Context: {ctx}\nCode: {code}" for code, ctx in samples]
+        return "\n\n".join(examples) if examples else "None"
+
+    def _generate_contextual_prompt(self, source_code):
         """
-        Generate the final prompt using LangChain PromptTemplate.
-        Pulls up to 3 examples from each DB (source, target, done) just like before.
+        Generate the final prompt. Uses the example blocks rendered in
+        prepare_context_dbs plus up to 3 recent entries from the done DB.
         """
-        # Example snippet templates
-        example_tmpl = PromptTemplate(
-            input_variables=["context", "code"],
-            template="Context: {context}\nCode: {code}"
-        )
-        prev_tmpl = PromptTemplate(
-            input_variables=["snippet"],
-            template="{snippet}"
-        )
-
-        # Render Source Examples (up to 3)
-        src_examples = []
-        for code, ctx in self.src_db['samples'][:3]:
-            src_examples.append(example_tmpl.format(context=ctx, code=code))
-        src_block = "\n\n".join(src_examples) if src_examples else "None"
-
-        # Render Target Examples (up to 3)
-        trg_examples = []
-        for code, ctx in self.trg_db['samples'][:3]:
-            trg_examples.append(example_tmpl.format(context=ctx, code=code))
-        trg_block = "\n\n".join(trg_examples) if trg_examples else "None"
+        # Source/Target example blocks are pre-rendered; only the
+        # previous-translations slice grows between calls.
+        src_block = self._src_block
+        trg_block = self._trg_block
 
         # Render Previous Translations (up to 3 most recent)
-        prev_examples = []
-        if self.done_db['samples']:
-            for snippet in self.done_db['samples'][-3:]:
-                prev_examples.append(prev_tmpl.format(snippet=snippet))
-        prev_block = "\n\n".join(prev_examples) if prev_examples else "None"
-
-        # Overall instruction template
-        overall_tmpl = PromptTemplate(
-            input_variables=["source_examples", "target_examples", "previous_translations", "code_to_translate"],
-            template=(
-                "Translate this Lisp code to modern Common Lisp while preserving all functionality.\n"
-                "The first knowledge source provided shall help you understand what this lisp code actually does, "
-                "the second language source describes the target implementation, so adhere to it in your answers. "
-                "The third knowledge source represents what you have done so far: You must always remain consistent to it!\n\n"
-                "While translating this Common Lisp code, always proceed step by step: "
-                "What is the expected input? What does the source code you shall translate do? "
-                "How do you preserve all its functionality using the target implementation?\n\n"
-                "Source Examples:\n{source_examples}\n\n"
-                "Target Examples:\n{target_examples}\n\n"
-                "Previous Translations:\n{previous_translations}\n\n"
-                "Code to translate:\n{code_to_translate}\n\n"
-                "Provide the translated code in a ```lisp block and explanations in a ```comments block. "
-                "If you include chain-of-thought or hidden reasoning, wrap it in <think>...</think> (or a ```think block)."
-            )
-        )
-
-        return overall_tmpl.format(
-            source_examples=src_block,
-            target_examples=trg_block,
-            previous_translations=prev_block,
-            code_to_translate=source_code
+        prev_block = "\n\n".join(self.done_db['samples'][-3:]) if self.done_db['samples'] else "None"
+
+        return (
+            "Translate this Lisp code to modern Common Lisp while preserving all functionality.\n"
+            "The first knowledge source provided shall help you understand what this lisp code actually does, "
+            "the second language source describes the target implementation, so adhere to it in your answers. "
+            "The third knowledge source represents what you have done so far: You must always remain consistent to it!\n\n"
+            "While translating this Common Lisp code, always proceed step by step: "
+            "What is the expected input? What does the source code you shall translate do? "
+            "How do you preserve all its functionality using the target implementation?\n\n"
+            f"Source Examples:\n{src_block}\n\n"
+            f"Target Examples:\n{trg_block}\n\n"
+            f"Previous Translations:\n{prev_block}\n\n"
+            f"Code to translate:\n{source_code}\n\n"
+            "Provide the translated code in a ```lisp block and explanations in a ```comments block. "
+            "If you include chain-of-thought or hidden reasoning, wrap it in <think>...</think> (or a ```think block)."
         )
 
     # --- Translation methods ----------------------------------------------
@@ -429,9 +724,11 @@ class LispTranslationRAG:
             with open(input_path, 'r', encoding='utf-8', errors='ignore') as f:
                 source_code = f.read()
 
-            file_hash = hashlib.md5(source_code.encode()).hexdigest()
-            if file_hash in self.translation_cache:
-                translated_code, comments, think = self.translation_cache[file_hash]
+            file_hash = _content_hash(source_code.encode())
+            with self._cache_lock:
+                cached_entry = self.translation_cache.get(file_hash)
+            if cached_entry is not None:
+                translated_code, comments, think = cached_entry
                 base_path = os.path.splitext(input_path)[0]
                 self._write_output(f"{base_path}.autot", translated_code)
                 self._write_output(f"{base_path}.comment", comments)
@@ -439,24 +736,68 @@ class LispTranslationRAG:
                     self._write_output(f"{base_path}.think", think)
                 return translated_code, comments
 
-            # --- Build prompt with LangChain ---
-            prompt = self._generate_contextual_prompt_with_langchain(source_code)
+            # --- Semantic short-circuit: reuse the translation of a
+            # near-identical file from done_db instead of re-generating ---
+            # Snapshot under the write lock so the embedding rows and the
+            # filepath list are consistent with each other: a concurrent
+            # _update_done_db must not publish one before the other
+            with self._write_lock:
+                done_embeddings = self.done_db['embeddings']
+                done_filepaths = self.done_db['filepaths'][:]
+            if done_embeddings.shape[0] > 0:
+                query = self._encode(self._preprocess_code(source_code))
+                sims = self._cosine_scores(done_embeddings, query)
+                best = int(sims.argmax())
+                if sims[best] > 0.98:
+                    prev_base = os.path.splitext(done_filepaths[best])[0]
+                    try:
+                        with open(prev_base + '.autot', 'r', encoding='utf-8') as f:
+                            translated_code = f.read()
+                    except OSError:
+                        translated_code = ''  # previous outputs are gone; generate afresh
+                    # Only reuse substantive output: an empty .autot from a
+                    # failed generation must not short-circuit its own retry
+                    if translated_code.strip():
+                        try:
+                            with open(prev_base + '.comment', 'r', encoding='utf-8') as f:
+                                comments = f.read()
+                        except OSError:
+                            comments = "No explanations provided"
+                        print(f"Reusing translation of near-identical file "
+                              f"{done_filepaths[best]} (similarity {sims[best]:.3f})")
+                        base_path = os.path.splitext(input_path)[0]
+                        self._write_output(f"{base_path}.autot", translated_code)
+                        self._write_output(f"{base_path}.comment", comments)
+                        return translated_code, comments
+
+            # --- Build prompt ---
+            prompt = self._generate_contextual_prompt(source_code)
+
+            # --- Check persistent prompt cache before calling Ollama ---
+            prompt_key = _content_hash((self.ollama + '|' + prompt).encode())
+            cached_output = self._prompt_cache.get(prompt_key) if self._prompt_cache is not None else None
 
             # --- Generate with/without streaming ---
             full_output = ""
-            if verbose:
+            if cached_output is not None:
+                full_output = cached_output
+            elif verbose:
                 stream = ollama.generate(
                     model=self.ollama,
                     prompt=prompt,
                     options={'temperature': 0.1, 'num_ctx': 4096},
                     stream=True
                 )
+                # Accumulate chunks in a StringIO: repeated += on a str
+                # re-copies the whole output for every token
+                buf = io.StringIO()
                 for chunk in stream:
                     part = chunk.get('response', '')
                     if part:
-                        full_output += part
+                        buf.write(part)
                         print(part, end='', flush=True)
                 print()
+                full_output = buf.getvalue()
             else:
                 resp = ollama.generate(
                     model=self.ollama,
@@ -465,6 +806,15 @@ class LispTranslationRAG:
                 )
                 full_output = resp.get('response', '')
 
+            # An empty response is a failed generation: don't cache it, write
+            # outputs, or record it in done_db, so the file stays retryable
+            if not full_output.strip():
+                print(f"Warning: Empty model response for {input_path}; skipping")
+                return None, "Empty response from model"
+
+            if cached_output is None and self._prompt_cache is not None:
+                self._prompt_cache.set(prompt_key, full_output)
+
             # --- After full output is available, split into files ---
             translated_code = self._extract_code_block(full_output)
             comments = self._extract_comments_block(full_output)
@@ -479,7 +829,8 @@ class LispTranslationRAG:
             # Update done_db after successful translation
             self._update_done_db(input_path, source_code)
 
-            self.translation_cache[file_hash] = (translated_code, comments, think)
+            with self._cache_lock:
+                self.translation_cache[file_hash] = (translated_code, comments, think)
             return translated_code, comments
 
         except Exception as e:
@@ -508,18 +859,38 @@ class LispTranslationRAG:
             with open("processed_files.txt", "r") as f3:
                 processed_files = {line.strip() for line in f3 if line.strip()}
 
+        pending = [path for path in all_files if path not in processed_files]
+
         with open("processed_files.txt", "a") as f3:
-            for path in all_files:
-                if path not in processed_files:
+            def record_success(path):
+                print(f"Successfully translated to: {os.path.splitext(path)[0]}.autot")
+                print(f"Comments saved to: {os.path.splitext(path)[0]}.comment")
+                print(f"Think saved to: {os.path.splitext(path)[0]}.think (if provided)")
+                with self._write_lock:
+                    f3.write(f"{path}\n")
+                    f3.flush()
+                    processed_files.add(path)
+
+            if verbose:
+                # Streamed token output would interleave across threads;
+                # stay serial when echoing to stdout
+                for path in pending:
                     print(f"\nTranslating: {path}")
-                    translated, comments = self.translate_file(path, verbose=verbose)
+                    translated, comments = self.translate_file(path, verbose=True)
                     if translated:
-                        print(f"Successfully translated to: {os.path.splitext(path)[0]}.autot")
-                        print(f"Comments saved to: {os.path.splitext(path)[0]}.comment")
-                        print(f"Think saved to: {os.path.splitext(path)[0]}.think (if provided)")
-                        f3.write(f"{path}\n")
-                        f3.flush()
-                        processed_files.add(path)
+                        record_success(path)
+            else:
+                # Ollama can service several requests at once; overlap the
+                # network/queue latency across files
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    futures = {executor.submit(self.translate_file, path): path
+                               for path in pending}
+                    for future in as_completed(futures):
+                        path = futures[future]
+                        print(f"\nTranslated: {path}")
+                        translated, comments = future.result()
+                        if translated:
+                            record_success(path)
 
 
 def parse_args():